@@ -22,16 +22,37 @@
 
 # pylint: disable=missing-docstring
 
+import hashlib
+import inspect
+import os
 import os.path as p
 import random
 import re
-import struct
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
 
 from vunit.ui import VUnit  # type: ignore
 from vunit.vunit_cli import VUnitCLI  # type: ignore
 
+try:
+    import re2  # type: ignore
+except ImportError:
+    re2 = None
+
 ROOT = p.abspath(p.dirname(__file__))
 
+# Flags are set inline (DOTALL, IGNORECASE, MULTILINE) so that the same pattern
+# works with both re and re2
+_PRAGMA_PATTERN = (
+    r"(?ism)\s*--\s*ghdl\s+translate_off[\r\n].*?[\n\r]\s*--\s*ghdl\s+translate_on"
+)
+
+if re2 is not None:
+    # RE2 runs in linear time, ASCII semantics for \s are already its default
+    _PRAGMA = re2.compile(_PRAGMA_PATTERN)
+else:
+    _PRAGMA = re.compile(_PRAGMA_PATTERN, flags=re.ASCII)
+
 
 class GhdlPragmaHandler:  # pylint: disable=too-few-public-methods
     """
@@ -41,19 +62,12 @@ class GhdlPragmaHandler:  # pylint: disable=too-few-public-methods
     -- ghdl translate_on
     """
 
-    _PRAGMA = re.compile(
-        r"\s*--\s*ghdl\s+translate_off[\r\n].*?[\n\r]\s*--\s*ghdl\s+translate_on",
-        flags=re.DOTALL | re.I | re.MULTILINE,
-    )
-
     def run(self, code, file_name):  # pylint: disable=unused-argument,no-self-use
-        for word in ("ghdl", "translate_on", "translate_off"):
-            if word not in code:
-                return code
-
-        result = self._PRAGMA.sub(r"", code)
+        # Any match must contain translate_off, skip the regex otherwise
+        if "translate_off" not in code:
+            return code
 
-        return result
+        return _PRAGMA.sub(r"", code)
 
 
 def main():
@@ -63,11 +77,18 @@ def main():
         action="store",
         help="Random seed for the tests",
         type=int,
-        default=random.randint(-1 << 31, 1 << 31),  # VHDL integer range
+        default=None,
     )
 
     args = cli.parse_args()
 
+    # Generated test data files only follow the seed when it's set explicitly,
+    # otherwise a new random seed on every run would force them to be
+    # regenerated every time
+    data_seed = args.seed
+    if args.seed is None:
+        args.seed = random.randint(-1 << 31, 1 << 31)  # VHDL integer range
+
     print(f"Seed: {args.seed}")
 
     cli = VUnit.from_args(args=args)
@@ -78,23 +99,23 @@ def main():
     if cli.get_simulator_name() == "ghdl":
         cli.add_preprocessor(GhdlPragmaHandler())
 
-    cli.add_library("fpga_cores").add_source_files(p.join(ROOT, "src", "*.vhd"))
+    cli.add_library("fpga_cores").add_source_files(listVhdlFiles("src"))
 
     cli.add_library("str_format").add_source_files(
-        p.join(ROOT, "dependencies", "hdl_string_format", "src", "*.vhd")
+        listVhdlFiles("dependencies", "hdl_string_format", "src")
     )
 
     cli.add_library("tb")
-    cli.library("tb").add_source_files(p.join(ROOT, "testbench", "*.vhd"))
+    cli.library("tb").add_source_files(listVhdlFiles("testbench"))
 
     cli.add_library("fpga_cores_sim")
-    cli.library("fpga_cores_sim").add_source_files(p.join(ROOT, "sim", "*.vhd"))
+    cli.library("fpga_cores_sim").add_source_files(listVhdlFiles("sim"))
 
     cli.add_library("exp_golomb").add_source_files(
-        p.join(ROOT, "src", "exponential_golomb", "*.vhd")
+        listVhdlFiles("src", "exponential_golomb")
     )
 
-    addTests(cli, args.seed)
+    addTests(cli, args.seed, data_seed)
 
     cli.set_compile_option("modelsim.vcom_flags", ["-explicit"])
 
@@ -114,11 +135,28 @@ def main():
     cli.main()
 
 
-def addTests(cli, seed):
+def listVhdlFiles(*path):
+    """
+    Returns the VHDL files directly under ROOT/<path>. Scans the directory
+    once and hands VUnit concrete paths instead of a pattern to expand.
+    """
+    with os.scandir(p.join(ROOT, *path)) as entries:
+        return sorted(
+            entry.path
+            for entry in entries
+            if entry.name.endswith(".vhd") and entry.is_file()
+        )
+
+
+def addTests(cli, seed, data_seed=None):
     addAsyncFifoTests(cli.library("tb").entity("async_fifo_tb"), seed)
     addAxiStreamDelayTests(cli.library("tb").entity("axi_stream_delay_tb"), seed)
-    addAxiFileReaderTests(cli.library("tb").entity("axi_file_reader_tb"), seed)
-    addAxiFileCompareTests(cli.library("tb").entity("axi_file_compare_tb"), seed)
+    addAxiFileReaderTests(
+        cli.library("tb").entity("axi_file_reader_tb"), seed, data_seed
+    )
+    addAxiFileCompareTests(
+        cli.library("tb").entity("axi_file_compare_tb"), seed, data_seed
+    )
     addAxiWidthConverterTests(
         cli.library("tb").entity("axi_stream_width_converter_tb"), seed
     )
@@ -175,17 +213,32 @@ def addAxiStreamDelayTests(entity, seed):
         )
 
 
-def addAxiFileCompareTests(entity, seed):
+def addAxiFileCompareTests(entity, seed, data_seed=None):
     "Parametrizes the AXI file compare testbench"
     test_file = p.join(ROOT, "vunit_out", "file_compare_input.bin")
     reference_file = p.join(ROOT, "vunit_out", "file_compare_reference_ok.bin")
+    stamp_file = p.join(ROOT, "vunit_out", "file_compare.stamp")
 
-    if not (p.exists(test_file) and p.exists(reference_file)):
-        generateAxiFileReaderTestFile(
+    stamp = getAxiFileReaderStamp(32, 32 * 8, data_seed)
+
+    # Files with errors are derived from the reference, so they need to be
+    # regenerated whenever the reference is
+    regenerate = not (
+        p.exists(test_file)
+        and p.exists(reference_file)
+        and readStamp(stamp_file) == stamp
+    )
+
+    if regenerate:
+        generate_args = dict(
             test_file=test_file,
             reference_file=reference_file,
             data_width=32,
             length=32 * 8,
+            seed=data_seed,
+        )
+        printAxiFileReaderTestFileInfo(
+            generate_args, generateAxiFileReaderTestFile(**generate_args)
         )
 
     tdata_single_error_file = p.join(
@@ -198,47 +251,46 @@ def addAxiFileCompareTests(entity, seed):
         ROOT, "vunit_out", "file_compare_reference_tlast_error.bin"
     )
 
-    if not p.exists(tdata_single_error_file):
+    if regenerate or not (
+        p.exists(tdata_single_error_file)
+        and p.exists(tdata_two_errors_file)
+        and p.exists(tlast_error_file)
+    ):
         with open(reference_file, "rb") as fd:
-            ref_data = fd.read().split(b"\n")
-
-        with open(tdata_single_error_file, "wb") as fd:
-            # Skip one, duplicate another so the size is the same
-            data = (
-                ref_data[:7]
-                + [
-                    ref_data[8],
-                ]
-                + ref_data[8:]
-            )
-            fd.write(b"\n".join(data))
+            ref_data = fd.read().splitlines()
+
+    def writeVariant(path, indexes, last_line=None):
+        # Writes the reference lines selected by <indexes>, optionally followed
+        # by <last_line>, without building intermediate lists
+        with open(path, "wb") as fd:
+            fd.writelines(ref_data[i] + b"\n" for i in indexes)
+            if last_line is not None:
+                fd.write(last_line + b"\n")
+
+    if regenerate or not p.exists(tdata_single_error_file):
+        # Skip one, duplicate another so the size is the same
+        writeVariant(
+            tdata_single_error_file, chain(range(7), [8], range(8, len(ref_data)))
+        )
 
-    if not p.exists(tdata_two_errors_file):
-        with open(reference_file, "rb") as fd:
-            ref_data = fd.read().split(b"\n")
-
-        with open(tdata_two_errors_file, "wb") as fd:
-            # Skip one, duplicate another so the size is the same
-            data = (
-                ref_data[:7]
-                + [ref_data[8], ref_data[8]]
-                + ref_data[9:16]
-                + [
-                    ref_data[17],
-                ]
-                + ref_data[17:]
-            )
-            fd.write(b"\n".join(data))
+    if regenerate or not p.exists(tdata_two_errors_file):
+        # Skip two, duplicate another two so the size is the same
+        writeVariant(
+            tdata_two_errors_file,
+            chain(range(7), [8], range(8, 16), [17], range(17, len(ref_data))),
+        )
 
-    if not p.exists(tlast_error_file):
-        with open(reference_file, "rb") as fd:
-            ref_data = fd.read().strip().split(b"\n")
+    if regenerate or not p.exists(tlast_error_file):
+        # Format is "tdata,tkeep,tlast", change tlast to 0
+        last_entry = ref_data[-1].split(b",")
+        writeVariant(
+            tlast_error_file,
+            range(len(ref_data) - 1),
+            last_line=b",".join([last_entry[0], b"0", b"0"]),
+        )
 
-        with open(tlast_error_file, "wb") as fd:
-            # Format is "tdata,tkeep,tlast", change tlast to 0
-            last_entry = ref_data[-1].split(b",")
-            data = ref_data[:-1] + [b",".join([last_entry[0], b"0", b"0"])]
-            fd.write(b"\n".join(data))
+    if regenerate:
+        writeStamp(stamp_file, stamp)
 
     entity.add_config(
         name="all",
@@ -253,7 +305,7 @@ def addAxiFileCompareTests(entity, seed):
     )
 
 
-def addAxiFileReaderTests(entity, seed):
+def addAxiFileReaderTests(entity, seed, data_seed=None):
     "Parametrizes the AXI file reader testbench"
     # Dict with data_width: {lengths in bytes}
     configs = {
@@ -263,6 +315,10 @@ def addAxiFileReaderTests(entity, seed):
         64: [16, 17, 18, 19],
     }
 
+    # Files are independent from each other, so the ones that need to be
+    # (re)generated are collected and then created together
+    pending = []
+
     for data_width, length_list in configs.items():
         all_configs = []
 
@@ -271,21 +327,32 @@ def addAxiFileReaderTests(entity, seed):
 
             test_file = p.join(ROOT, "vunit_out", basename + "_input.bin")
             reference_file = p.join(ROOT, "vunit_out", basename + "_reference.bin")
+            stamp_file = p.join(ROOT, "vunit_out", basename + ".stamp")
+
+            stamp = getAxiFileReaderStamp(data_width, length, data_seed)
 
-            if not (p.exists(test_file) and p.exists(reference_file)) or (
-                p.getmtime(__file__)
-                > max(p.getmtime(test_file), p.getmtime(reference_file))
+            if not (
+                p.exists(test_file)
+                and p.exists(reference_file)
+                and readStamp(stamp_file) == stamp
             ):
-                generateAxiFileReaderTestFile(
-                    test_file=test_file,
-                    reference_file=reference_file,
-                    data_width=data_width,
-                    length=length,
+                pending.append(
+                    (
+                        stamp_file,
+                        stamp,
+                        dict(
+                            test_file=test_file,
+                            reference_file=reference_file,
+                            data_width=data_width,
+                            length=length,
+                            seed=data_seed,
+                        ),
+                    )
                 )
 
             test_cfg = ",".join([test_file, reference_file])
 
-            all_configs += [test_cfg]
+            all_configs.append(test_cfg)
 
         entity.add_config(
             name=f"multiple,data_width={data_width}",
@@ -294,83 +361,168 @@ def addAxiFileReaderTests(entity, seed):
             ),
         )
 
+    generateAxiFileReaderTestFiles(pending)
+
+
+# Minimum amount of test data pending generation to justify using a process
+# pool instead of generating files one after the other
+_PARALLEL_GENERATION_MIN_BYTES = 1 << 20
+
+
+def generateAxiFileReaderTestFiles(pending):
+    """
+    Runs generateAxiFileReaderTestFile for each (stamp_file, stamp, kwargs) in
+    <pending>, writing <stamp> to <stamp_file> once the files are created
+    """
+    # Starting worker processes costs far more than generating a few small
+    # files, only use them when there's a substantial amount of data
+    total_length = sum(kwargs["length"] for _, _, kwargs in pending)
+    if len(pending) < 2 or total_length < _PARALLEL_GENERATION_MIN_BYTES:
+        for stamp_file, stamp, kwargs in pending:
+            test_data = generateAxiFileReaderTestFile(**kwargs)
+            printAxiFileReaderTestFileInfo(kwargs, test_data)
+            writeStamp(stamp_file, stamp)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=min(len(pending), os.cpu_count() or 1)
+    ) as executor:
+        jobs = [
+            (
+                stamp_file,
+                stamp,
+                kwargs,
+                executor.submit(generateAxiFileReaderTestFile, **kwargs),
+            )
+            for stamp_file, stamp, kwargs in pending
+        ]
+
+        for stamp_file, stamp, kwargs, job in jobs:
+            # Only write the stamp once files have been generated successfully
+            printAxiFileReaderTestFileInfo(kwargs, job.result())
+            writeStamp(stamp_file, stamp)
+
+
+def getAxiFileReaderStamp(data_width, length, seed):
+    """
+    Returns a key that changes whenever the contents generated by
+    generateAxiFileReaderTestFile for the given arguments would change
+    """
+    digest = hashlib.sha1(inspect.getsource(generateAxiFileReaderTestFile).encode())
+    digest.update(repr((data_width, length, seed)).encode())
+    return digest.hexdigest()
+
+
+def writeStamp(stamp_file, stamp):
+    "Writes <stamp> to <stamp_file>"
+    with open(stamp_file, "w", encoding="ascii") as fd:
+        fd.write(stamp)
+
+
+def readStamp(stamp_file):
+    "Returns the contents of <stamp_file> or None if it can't be read"
+    try:
+        with open(stamp_file, "r", encoding="ascii") as fd:
+            return fd.read().strip()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+# Bit reversed value of every byte, indexed by the byte itself
+_BITREV8 = tuple(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
 
 def swapBits(value, width=8):
     "Swaps LSB and MSB bits of <value>, considering its width is <width>"
-    v_in_binary = bin(value)[2:]
-
-    assert len(v_in_binary) <= width, "input is too big"
+    assert value >> width == 0, "input is too big"
 
-    v_in_binary = "0" * (width - len(v_in_binary)) + v_in_binary
-    return int(v_in_binary[::-1], 2)
+    if width == 8:
+        return _BITREV8[value]
 
+    # Reverse byte by byte, then drop the padding bits added to the LSBs
+    nbytes = (width + 7) // 8
+    result = 0
+    for _ in range(nbytes):
+        result = (result << 8) | _BITREV8[value & 0xFF]
+        value >>= 8
 
-def generateAxiFileReaderTestFile(test_file, reference_file, data_width, length):
-    "Create a pair of test files for the AXI file reader testbench"
-    print("Generating AXI file reader test files")
-    print("- test_file:      ", test_file)
-    print("- reference_file: ", reference_file)
-    print("- data_width:     ", data_width, "bits")
-    print("- length:         ", length, "bytes")
+    return result >> (8 * nbytes - width)
 
-    test_data = tuple(random.randint(0, 255) for _ in range(length))
 
-    print("- test_data:      ", test_data)
+def printAxiFileReaderTestFileInfo(generate_args, test_data):
+    """
+    Prints a summary of test files created by generateAxiFileReaderTestFile
+    called with <generate_args>
+    """
+    print("Generated AXI file reader test files")
+    print("- test_file:      ", generate_args["test_file"])
+    print("- reference_file: ", generate_args["reference_file"])
+    print("- data_width:     ", generate_args["data_width"], "bits")
+    print("- length:         ", generate_args["length"], "bytes")
+    print("- seed:           ", generate_args.get("seed"))
+    print("- test_data:      ", test_data.hex())
+
+
+def generateAxiFileReaderTestFile(
+    test_file, reference_file, data_width, length, seed=None
+):
+    """
+    Create a pair of test files for the AXI file reader testbench. Returns the
+    test data written to <test_file>
+    """
+    # Mix the width and length into the seed so that each file gets different
+    # data but can still be reproduced from the seed passed to run.py. Without a
+    # seed the data is random
+    rng = random.Random(None if seed is None else f"{seed},{data_width},{length}")
+    test_data = rng.randbytes(length)
 
     with open(test_file, "wb") as fd:
-        fd.write(struct.pack("<" + length * "B", *test_data))
+        fd.write(test_data)
 
+    # Reference file contents, each line is "tdata,tkeep,tlast"
+    out = bytearray()
     # Format will depend on the data width, need to be wide enough for to fit
     # one character per nibble
-    lines = []
-    tkeep_fmt = f"%.{data_width//8//4}x"
+    tkeep_fmt = f"%.{data_width//8//4}x".encode()
 
     if data_width >= 8:
+        # tkeep only depends on the number of valid bytes, so format every
+        # possible value upfront. Words that are not the last one use tkeep=0
+        tkeep_table = [tkeep_fmt % ((1 << i) - 1) for i in range(data_width // 8 + 1)]
         line = []
-        tkeep = 0
         for i, byte in enumerate(test_data):
-            line.insert(0, f"{byte:02x}")
+            # Bytes are appended LSB first, reverse them when emitting the word
+            line.append(b"%02x" % byte)
             tlast = i == length - 1
             if (8 * (i + 1) % data_width) == 0:
-                if tlast:
-                    tkeep = (1 << len(line)) - 1
-                lines += [
-                    ",".join(["".join(line), tkeep_fmt % tkeep, "1" if tlast else "0"])
-                ]
+                out += b"%s,%s,%s\n" % (
+                    b"".join(reversed(line)),
+                    tkeep_table[len(line)] if tlast else tkeep_table[0],
+                    b"1" if tlast else b"0",
+                )
                 line = []
         if line:
-            tkeep = (1 << len(line)) - 1
-            line = (data_width // 8 - len(line)) * ["00"] + line
-            lines += [",".join(["".join(line), tkeep_fmt % tkeep, "1"])]
+            word = (data_width // 8 - len(line)) * b"00" + b"".join(reversed(line))
+            out += b"%s,%s,1\n" % (word, tkeep_table[len(line)])
     else:
         # Flatten the test data into a bit string and slice it with data_width
-        for i, byte in enumerate(test_data):
-            print(i, hex(byte))
-        flattened_bin_data = ""
-        for byte in test_data:
-            # Convert integer into binary with the LSB to the left so index 0
-            # of the flattened array is index 0 of the first word
-            little_endian_word = "".join(reversed(bin(byte)[2:]))
-            # Adjust result of 'bin' to 8 bits width and append it to the flattened
-            # buffer
-            flattened_bin_data += little_endian_word + "0" * (
-                8 - len(little_endian_word)
-            )
+        # Convert each byte into 8 bits binary with the LSB to the left so index 0
+        # of the flattened array is index 0 of the first word
+        flattened_bin_data = "".join(f"{byte:08b}"[::-1] for byte in test_data)
 
-        print(flattened_bin_data, len(flattened_bin_data))
         assert len(flattened_bin_data) % 8 == 0
 
-        lines = []
-        while flattened_bin_data:
-            word = int(flattened_bin_data[:data_width], 2)
-            flattened_bin_data = flattened_bin_data[data_width:]
+        total_bits = len(flattened_bin_data)
+        for offset in range(0, total_bits, data_width):
+            word = int(flattened_bin_data[offset : offset + data_width], 2)
+
+            tlast = offset + data_width >= total_bits
+            out += b"%x,,%s\n" % (word, b"1" if tlast else b"0")
 
-            tlast = not flattened_bin_data
-            lines += [",".join([f"{word:x}", "", "1" if tlast else "0"])]
+    with open(reference_file, "wb") as fd:
+        fd.write(out)
 
-    with open(reference_file, "w") as fd:
-        fd.write("\n".join(lines))
-        fd.write("\n")
+    return test_data
 
 
 def addAxiWidthConverterTests(entity, seed):